@@ -1,18 +1,38 @@
 import streamlit as st
-import os
-import tempfile
+import pandas as pd
+import io
+from collections import deque
+import hashlib
 from dotenv import load_dotenv
-from utils import DocumentProcessor
+from utils import DocumentProcessor, MAX_CACHED_VECTORSTORES, PERFORMANCE_LOG_SIZE
 import ui_utils as ui
 
 load_dotenv()
 
+# Keyed on the upload's digest; the leading underscore keeps Streamlit from hashing the raw bytes on every call.
+# Bounded like the on-disk store cache, since each entry holds an index, its documents and two thread pools.
+@st.cache_resource(show_spinner=False, max_entries=MAX_CACHED_VECTORSTORES)
+def build_qa(openai_api_key, file_sha256, file_name, _file_bytes):
+    doc_processor = DocumentProcessor(openai_api_key, enable_semantic_cache=True)
+    # Reuses the on-disk store for this file, model and chunking when one exists.
+    vectorstore, build_info = doc_processor.load_or_create_vectorstore(io.BytesIO(_file_bytes), file_name, file_hash=file_sha256)
+
+    qa_chain = doc_processor.create_qa_chain(vectorstore)
+    document_details = {
+        'file_name': file_name,
+        'chunk_count': build_info['chunk_count'],
+        'processing_time': doc_processor.get_performance_summary().get('total_processing_time', 0)
+    }
+    return doc_processor, qa_chain, document_details
+
 def main():
     ui.display_header()
     ui.display_welcome_message()
 
     if 'chat_history' not in st.session_state:
         st.session_state.chat_history = []
+    if 'chat_tuples' not in st.session_state:
+        st.session_state.chat_tuples = []
     if 'document_processed' not in st.session_state:
         st.session_state.document_processed = False
     if 'doc_processor' not in st.session_state:
@@ -21,6 +41,9 @@ def main():
         st.session_state.qa_chain = None
     if 'document_details' not in st.session_state:
         st.session_state.document_details = {}
+    if 'perf_log' not in st.session_state:
+        # Only the most recent answers are charted; the frame is built from this window on each render.
+        st.session_state.perf_log = deque(maxlen=PERFORMANCE_LOG_SIZE)
 
     uploaded_file, openai_api_key, process_btn = ui.display_sidebar()
 
@@ -32,48 +55,45 @@ def main():
         else:
             with st.spinner("Processing your document... This might take a moment."):
                 try:
-                    with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-                        tmp_file.write(uploaded_file.getvalue())
-                        tmp_path = tmp_file.name
-
-                    st.session_state.doc_processor = DocumentProcessor(openai_api_key)
-
-                    docs, _ = st.session_state.doc_processor.load_document(tmp_path)
-                    splits, split_info = st.session_state.doc_processor.split_documents(docs)
-                    vectorstore, _ = st.session_state.doc_processor.create_vectorstore(splits)
-                    st.session_state.qa_chain = st.session_state.doc_processor.create_qa_chain(vectorstore)
-
-                    st.session_state.document_details = {
-                        'file_name': uploaded_file.name,
-                        'chunk_count': split_info['output_chunks'],
-                        'processing_time': st.session_state.doc_processor.get_performance_summary().get('total_processing_time', 0)
-                    }
+                    file_bytes = uploaded_file.getvalue()
+                    (st.session_state.doc_processor,
+                     st.session_state.qa_chain,
+                     st.session_state.document_details) = build_qa(openai_api_key, hashlib.sha256(file_bytes).hexdigest(),
+                                                                   uploaded_file.name, file_bytes)
 
                     st.session_state.document_processed = True
                     st.sidebar.success("✅ Document processed successfully!")
-                    os.unlink(tmp_path)
 
                 except Exception as e:
                     st.sidebar.error(f"Error processing document: {e}")
 
     if st.session_state.document_processed:
+        # chat_input can't live inside columns; it is pinned to the bottom of the page and returns a value once per submit.
+        question = st.chat_input("What would you like to know? e.g., 'What was the revenue growth last year?'")
         col1, col2 = st.columns([2, 1])
         with col1:
-            question = ui.display_chat_interface(st.session_state.chat_history)
+            chat_box = ui.display_chat_interface(st.session_state.chat_history)
             if question:
                 st.session_state.chat_history.append(question)
-                with st.spinner("Searching for insights..."):
-                    result, _ = st.session_state.doc_processor.process_query(
-                        st.session_state.qa_chain,
-                        question,
-                        st.session_state.chat_history[:-1]
-                    )
-                    st.session_state.chat_history.append(result['answer'])
-                    st.experimental_rerun()
+                with chat_box:
+                    ui.display_message(question, is_user=True)
+                    answer_placeholder = st.empty()
+                result, perf_data = st.session_state.doc_processor.process_query(
+                    st.session_state.qa_chain,
+                    question,
+                    st.session_state.chat_tuples,
+                    callbacks=[ui.StreamingAnswerHandler(answer_placeholder)]
+                )
+                answer = result['answer']
+                ui.display_message(answer, is_user=False, target=answer_placeholder)
+                st.session_state.chat_history.append(answer)
+                st.session_state.chat_tuples.append((question, answer))
+                st.session_state.perf_log.append((len(st.session_state.chat_tuples), perf_data['operation'], perf_data['processing_time']))
 
         with col2:
+            perf_df = pd.DataFrame(list(st.session_state.perf_log), columns=["question", "operation", "processing_time"])
             ui.display_insights_dashboard(
-                st.session_state.doc_processor.performance_logs,
+                perf_df.set_index("question"),
                 st.session_state.document_details
             )
     else:
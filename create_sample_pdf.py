@@ -6,8 +6,47 @@ Utility script to convert the sample financial report text file to PDF format fo
 
 import os
 import sys
+import mmap
+import itertools
+from operator import itemgetter
 from fpdf import FPDF
 
+HEADER_FONT_SIZES = {'h1': 16, 'h2': 14, 'h3': 12, 'h4': 11}
+
+def classify_line(line):
+    """Classify a line of the text report into a (style, text) pair."""
+    line = line.strip()
+    
+    if line.startswith('# '):
+        return 'h1', line[2:]
+    elif line.startswith('## '):
+        return 'h2', line[3:]
+    elif line.startswith('### '):
+        return 'h3', line[4:]
+    elif line.startswith('#### '):
+        return 'h4', line[5:]
+    elif line.startswith('- '):
+        return 'bullet', line[2:]
+    elif line and line[0].isdigit() and line[1:].startswith('. '):
+        return 'numbered', line
+    elif line.startswith('|') and '-|-' in line:
+        return 'table_rule', line  # Table formatting lines are skipped
+    elif line.startswith('|'):
+        return 'table', line
+    elif line:
+        return 'text', line
+    else:
+        return 'blank', line
+
+def iter_lines(input_file):
+    """Yield the lines of a text file from a read-only memory map."""
+    # Empty files cannot be memory-mapped
+    if os.path.getsize(input_file) == 0:
+        return
+    with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for raw in iter(mm.readline, b""):
+            yield raw.decode('utf-8', 'replace').rstrip('\n')
+
 def create_pdf_from_text(input_file, output_file):
     """Convert a text file to PDF format."""
     try:
@@ -16,63 +55,47 @@ def create_pdf_from_text(input_file, output_file):
             print(f"Error: Input file '{input_file}' not found.")
             return False
         
-        # Read the text file
-        with open(input_file, 'r') as f:
-            content = f.readlines()
-        
         # Create PDF
         pdf = FPDF()
         pdf.add_page()
         pdf.set_auto_page_break(auto=True, margin=15)
         
-        # Set font for title
-        pdf.set_font("Arial", "B", 16)
-        
-        # Process content line by line
-        for line in content:
-            line = line.strip()
+        # Render runs of same-style lines together so fonts are set once per run
+        for style, group in itertools.groupby(map(classify_line, iter_lines(input_file)), key=itemgetter(0)):
+            texts = [text for _, text in group]
             
             # Handle headers
-            if line.startswith('# '):
-                pdf.set_font("Arial", "B", 16)
-                pdf.cell(0, 10, line[2:], ln=True)
-            elif line.startswith('## '):
-                pdf.set_font("Arial", "B", 14)
-                pdf.cell(0, 10, line[3:], ln=True)
-            elif line.startswith('### '):
-                pdf.set_font("Arial", "B", 12)
-                pdf.cell(0, 10, line[4:], ln=True)
-            elif line.startswith('#### '):
-                pdf.set_font("Arial", "B", 11)
-                pdf.cell(0, 10, line[5:], ln=True)
+            if style in HEADER_FONT_SIZES:
+                pdf.set_font("Arial", "B", HEADER_FONT_SIZES[style])
+                pdf.multi_cell(0, 10, "\n".join(texts))
             # Handle bullet points
-            elif line.startswith('- '):
+            elif style == 'bullet':
                 pdf.set_font("Arial", "", 10)
-                pdf.cell(10, 6, "•", ln=0)
-                pdf.multi_cell(0, 6, line[2:])
+                for text in texts:
+                    pdf.cell(10, 6, "•", ln=0)
+                    pdf.multi_cell(0, 6, text)
             # Handle numbered lists
-            elif line and line[0].isdigit() and line[1:].startswith('. '):
+            elif style == 'numbered':
                 pdf.set_font("Arial", "", 10)
-                pdf.cell(10, 6, line.split('. ')[0] + ".", ln=0)
-                pdf.multi_cell(0, 6, line.split('. ')[1])
-            # Handle table headers
-            elif line.startswith('|') and '-|-' in line:
-                continue  # Skip table formatting lines
+                for text in texts:
+                    pdf.cell(10, 6, text.split('. ')[0] + ".", ln=0)
+                    pdf.multi_cell(0, 6, text.split('. ')[1])
             # Handle table rows
-            elif line.startswith('|'):
+            elif style == 'table':
                 pdf.set_font("Arial", "", 9)
-                cells = [cell.strip() for cell in line.split('|')[1:-1]]
-                cell_width = 190 / len(cells)
-                for cell in cells:
-                    pdf.cell(cell_width, 6, cell, border=1)
-                pdf.ln()
+                for text in texts:
+                    cells = [cell.strip() for cell in text.split('|')[1:-1]]
+                    cell_width = 190 / len(cells)
+                    for cell in cells:
+                        pdf.cell(cell_width, 6, cell, border=1)
+                    pdf.ln()
             # Handle regular text
-            elif line:
+            elif style == 'text':
                 pdf.set_font("Arial", "", 10)
-                pdf.multi_cell(0, 6, line)
+                pdf.multi_cell(0, 6, "\n".join(texts))
             # Handle empty lines
-            else:
-                pdf.ln(3)
+            elif style == 'blank':
+                pdf.ln(3 * len(texts))
         
         # Save the PDF
         pdf.output(output_file)
@@ -9,7 +9,7 @@ from utils import DocumentProcessor
 # Load environment variables
 load_dotenv()
 
-def evaluate_system(document_path, questions_path, output_path=None):
+def evaluate_system(document_path, questions_path, output_path=None, max_workers=8):
     """Evaluate the RAG system on a set of test questions."""
     # Check if OpenAI API key is available
     api_key = os.getenv("OPENAI_API_KEY")
@@ -36,37 +36,43 @@ def evaluate_system(document_path, questions_path, output_path=None):
     print(f"Creating QA chain")
     qa_chain = processor.create_qa_chain(vectorstore)
     
-    # Evaluate each question
-    results = []
-    chat_history = []
-    
-    for i, item in enumerate(test_data):
-        question = item["question"]
-        expected_answer = item.get("expected_answer", None)  # Optional ground truth
-        
-        print(f"\nProcessing question {i+1}/{len(test_data)}: {question}")
-        
-        # Process query
-        start_time = time.time()
-        result, perf_data = processor.process_query(qa_chain, question, chat_history)
-        end_time = time.time()
-        
-        # Update chat history for context
-        chat_history.append((question, result["answer"]))
-        
-        # Store result
-        eval_result = {
-            "question": question,
+    def to_eval_result(item, result, processing_time):
+        return {
+            "question": item["question"],
             "answer": result["answer"],
-            "expected_answer": expected_answer,
-            "processing_time": end_time - start_time,
+            "expected_answer": item.get("expected_answer", None),  # Optional ground truth
+            "processing_time": processing_time,
             "source_documents": [doc.page_content[:100] + "..." for doc in result["source_documents"]]
         }
+    
+    # Evaluate each question
+    if max_workers > 1:
+        # Questions run concurrently, so each one is answered without chat history
+        print(f"\nProcessing {len(test_data)} questions, {max_workers} at a time")
+        outputs = processor.process_queries(qa_chain, [item["question"] for item in test_data], max_concurrency=max_workers)
+        results = [to_eval_result(item, result, perf_data["processing_time"])
+                   for item, (result, perf_data) in zip(test_data, outputs)]
         
-        results.append(eval_result)
+        for i, eval_result in enumerate(results):
+            print(f"\nQuestion {i+1}/{len(test_data)}: {eval_result['question']}")
+            print(f"Answer: {eval_result['answer'][:100]}...")
+            print(f"Processing time: {eval_result['processing_time']:.2f} seconds")
+    else:
+        results = []
+        chat_history = []
         
-        print(f"Answer: {result['answer'][:100]}...")
-        print(f"Processing time: {end_time - start_time:.2f} seconds")
+        for i, item in enumerate(test_data):
+            print(f"\nProcessing question {i+1}/{len(test_data)}: {item['question']}")
+            start_time = time.perf_counter()
+            result, _ = processor.process_query(qa_chain, item["question"], chat_history)
+            eval_result = to_eval_result(item, result, time.perf_counter() - start_time)
+            
+            # Update chat history for context
+            chat_history.append((eval_result["question"], eval_result["answer"]))
+            results.append(eval_result)
+            
+            print(f"Answer: {eval_result['answer'][:100]}...")
+            print(f"Processing time: {eval_result['processing_time']:.2f} seconds")
     
     # Calculate overall statistics
     avg_time = sum(r["processing_time"] for r in results) / len(results)
@@ -116,6 +122,7 @@ def main():
     parser.add_argument("--questions", "-q", type=str, help="Path to the questions JSON file")
     parser.add_argument("--output", "-o", type=str, help="Path to save evaluation results")
     parser.add_argument("--create-sample", "-s", action="store_true", help="Create a sample questions file")
+    parser.add_argument("--workers", "-w", type=int, default=8, help="Number of questions to answer concurrently (use 1 to chain chat history)")
     
     args = parser.parse_args()
     
@@ -127,7 +134,7 @@ def main():
         parser.print_help()
         return
     
-    evaluate_system(args.document, args.questions, args.output)
+    evaluate_system(args.document, args.questions, args.output, args.workers)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
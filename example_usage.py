@@ -3,10 +3,14 @@ import os
 import sys
 import time
 from dotenv import load_dotenv
+from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
 from utils import DocumentProcessor
 
 load_dotenv()
 
+EXIT_CMDS = frozenset({"exit", "quit", "q"})
+_SEP = "-" * 50
+
 def main():
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
@@ -31,17 +35,11 @@ def main():
     processor = DocumentProcessor(api_key)
     
     print(f"\nOpening your document: {os.path.basename(document_path)}")
-    documents, _ = processor.load_document(document_path)
-    print(f" Successfully loaded {len(documents)} pages/sections")
-    
-    print(f"\n  Breaking down the document into digestible pieces...")
-    splits, split_data = processor.split_documents(documents)
-    print(f" Created {len(splits)} manageable chunks of information")
-    
-    print(f"\n Building a smart knowledge base from your document...")
-    start_time = time.time()
-    vectorstore, _ = processor.create_vectorstore(splits)
-    print(f" Knowledge base ready in {time.time() - start_time:.2f} seconds")
+    print(f"\n  Breaking down the document and building a smart knowledge base from it...")
+    # Pages are read, split and embedded as they stream in, so the whole document is never held at once.
+    vectorstore, build_info = processor.create_vectorstore(processor.stream_load_and_split(document_path))
+    print(f" Created {build_info['chunk_count']} manageable chunks of information")
+    print(f" Knowledge base ready in {build_info['processing_time']:.2f} seconds")
     
     print(f"\n  Connecting the AI assistant to your document...")
     qa_chain = processor.create_qa_chain(vectorstore)
@@ -54,24 +52,28 @@ def main():
     
     while True:
         question = input("\n What would you like to know? ")
-        if question.lower() in ['exit', 'quit', 'q']:
+        if question.lower() in EXIT_CMDS:
             break
         
         print(" Searching through your document for the best answer...")
+        print(f"\n Here's what I found:\n\n{_SEP}")
         start_time = time.time()
-        result, _ = processor.process_query(qa_chain, question, chat_history)
+        # Tokens are printed as they arrive; cached answers come back whole.
+        result, perf_data = processor.process_query(qa_chain, question, chat_history,
+                                                    callbacks=[StreamingStdOutCallbackHandler()])
+        answer = result["answer"]
+        sources = result.get("source_documents", [])
+        if perf_data["cache_hit"]:
+            print(answer, end="")
         
         search_time = time.time() - start_time
-        print(f"\n Here's what I found (in {search_time:.2f} seconds):")
-        print(f"\n{'-'*50}")
-        print(f"{result['answer']}")
-        print(f"{'-'*50}")
+        print(f"\n{_SEP}\n Answered in {search_time:.2f} seconds")
         
-        chat_history.append((question, result["answer"]))
+        chat_history.append((question, answer))
         
-        if result["source_documents"]:
+        if sources:
             print(f"\n Based on these sections of your document:")
-            for i, doc in enumerate(result["source_documents"][:3]):
+            for i, doc in enumerate(sources[:3]):
                 print(f"  {i+1}. \"{doc.page_content[:100]}...\"")
     
     print("\n⚡ Performance Overview:")
@@ -7,8 +7,8 @@ This script checks for required dependencies and environment variables.
 
 import sys
 import os
-import importlib.util
 import platform
+from importlib import metadata
 
 def check_python_version():
     """Check if Python version is compatible."""
@@ -23,21 +23,24 @@ def check_python_version():
         print(f"✅ Python version: {current_version[0]}.{current_version[1]}.{current_version[2]}")
         return True
 
-def check_package(package_name):
+def get_installed_packages():
+    """List installed distributions from their metadata, without importing them or needing pip."""
+    installed = {}
+    for dist in metadata.distributions():
+        name = dist.metadata["Name"]
+        if name:
+            installed[name.lower().replace('_', '-').replace('.', '-')] = dist.version
+    return installed
+
+def check_package(package_name, installed):
     """Check if a package is installed."""
-    spec = importlib.util.find_spec(package_name)
-    if spec is None:
+    version = installed.get(package_name.lower())
+    if version is None:
         print(f"❌ {package_name} is not installed.")
         return False
     else:
-        try:
-            module = importlib.import_module(package_name)
-            version = getattr(module, '__version__', 'unknown')
-            print(f"✅ {package_name} is installed (version: {version})")
-            return True
-        except ImportError:
-            print(f"❌ {package_name} is installed but could not be imported.")
-            return False
+        print(f"✅ {package_name} is installed (version: {version})")
+        return True
 
 def check_openai_api_key():
     """Check if OpenAI API key is set."""
@@ -66,22 +69,29 @@ def main():
     
     # Check required packages
     print("\nChecking required packages:")
+    # Distribution names, not import names.
     packages = [
         'streamlit',
         'langchain',
+        'langchain-community',
+        'langchain-openai',
         'openai',
-        'chromadb',
+        'httpx',
+        'faiss-cpu',
+        'numpy',
+        'tiktoken',
         'pandas',
-        'dotenv',
-        'PyPDF2',
+        'python-dotenv',
+        'pypdf',
         'docx2txt',
         'matplotlib',
         'plotly'
     ]
     
+    installed = get_installed_packages()
     packages_ok = True
     for package in packages:
-        package_ok = check_package(package)
+        package_ok = check_package(package, installed)
         packages_ok = packages_ok and package_ok
     
     # Check OpenAI API key
@@ -1,6 +1,16 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
+from langchain.callbacks.base import BaseCallbackHandler
+
+class StreamingAnswerHandler(BaseCallbackHandler):
+
+    def __init__(self, placeholder):
+        self.placeholder = placeholder
+        self.text = ""
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.text += token
+        display_message(self.text + "▌", is_user=False, target=self.placeholder)
 
 def display_header():
     st.set_page_config(page_title="Smart Investment Report Analyzer", layout="wide")
@@ -27,7 +37,7 @@ def display_welcome_message():
         2.  **Ask Me Anything:** Use plain English to ask questions about the report.
         3.  **Get Clear Answers:** I'll provide you with answers that are grounded in the document's content.
         
-        Your documents are handled securely and are not stored after your session ends. Let's get started!
+        To speed up repeat analyses, this server keeps a local cache: the text and index of the ten most recently analyzed documents, chunk embeddings for up to 30 days, and the most recent answers. Cached answers can be reused for anyone who asks the same question about the same document. Let's get started!
         """)
 
 def display_sidebar():
@@ -39,37 +49,34 @@ def display_sidebar():
         process_btn = st.button("Analyze My Document")
     return uploaded_file, openai_api_key, process_btn
 
+def display_message(message, is_user, target=st):
+    target.chat_message("user" if is_user else "assistant").markdown(message)
+
 def display_chat_interface(chat_history):
     st.header("Let's Chat About Your Report 💬")
     
-    for i, message in enumerate(chat_history):
-        if i % 2 == 0:
-            st.markdown(f"<div style='background-color: #E3F2FD; padding: 10px; border-radius: 10px; margin-bottom: 10px;'><strong>You:</strong> {message}</div>", unsafe_allow_html=True)
-        else:
-            st.markdown(f"<div style='background-color: #F1F5F9; padding: 10px; border-radius: 10px; margin-bottom: 10px;'><strong>Financial Assistant:</strong> {message}</div>", unsafe_allow_html=True)
-            
-    question = st.text_input("What would you like to know?", placeholder="e.g., 'What was the revenue growth last year?'")
+    chat_box = st.container()
+    with chat_box:
+        for i, message in enumerate(chat_history):
+            display_message(message, is_user=i % 2 == 0)
     
     if not chat_history:
-        st.info("👆 Ask me anything about the report. I'll find the answers for you.")
+        st.info("👇 Ask me anything about the report. I'll find the answers for you.")
         
-    return question
+    return chat_box
 
-def display_insights_dashboard(performance_logs, document_details):
+def display_insights_dashboard(perf_df, document_details):
     st.header("Your Insights Dashboard 📊")
     
     with st.expander("How I'm Performing For You", expanded=True):
-        if performance_logs:
-            qa_logs = [log for log in performance_logs if log["operation"] == "query_processing"]
-            if qa_logs:
-                avg_response_time = sum(log["processing_time"] for log in qa_logs) / len(qa_logs)
-                st.metric("Average Answer Speed", f"{avg_response_time:.2f} sec")
-                
-                if len(qa_logs) > 1:
-                    df = pd.DataFrame(qa_logs)
-                    fig = px.line(df, y="processing_time", labels={"index": "Question #", "processing_time": "Response Time (s)"})
-                    fig.update_layout(height=250, margin=dict(l=20, r=20, t=30, b=20))
-                    st.plotly_chart(fig, use_container_width=True)
+        if not perf_df.empty:
+            avg_response_time = perf_df["processing_time"].mean()
+            st.metric("Average Answer Speed", f"{avg_response_time:.2f} sec")
+            
+            if len(perf_df) > 1:
+                fig = px.line(perf_df, y="processing_time", labels={"question": "Question #", "processing_time": "Response Time (s)"})
+                fig.update_layout(height=250, margin=dict(l=20, r=20, t=30, b=20))
+                st.plotly_chart(fig, use_container_width=True)
 
     with st.expander("About Your Document"):
         if document_details:
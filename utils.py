@@ -1,145 +1,1107 @@
 import os
+import io
+import re
 import time
+import asyncio
+import json
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import threading
+import queue
+import atexit
 import logging
-from typing import List, Dict, Any, Tuple
-from langchain.document_loaders import PyPDFLoader, Docx2txtLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.vectorstores import Chroma
-from langchain.chat_models import ChatOpenAI
-from langchain.chains import ConversationalRetrievalChain
-from langchain.schema import Document
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+from logging.handlers import QueueHandler, QueueListener
+from collections import Counter, OrderedDict, defaultdict, deque
+from contextlib import closing, contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain
+from typing import List, Dict, Any, Tuple, Optional, Union, BinaryIO, Iterable, Iterator, DefaultDict, Deque
+import docx2txt
+import faiss
+import numpy as np
+import tiktoken
+import httpx
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from pypdf import PdfReader
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain.text_splitter import TokenTextSplitter
+from langchain.storage import InMemoryStore
+from langchain.retrievers import MultiVectorRetriever, ContextualCompressionRetriever
+from langchain.retrievers.multi_vector import SearchType
+from langchain.schema.embeddings import Embeddings
+from langchain.schema import Document, BaseRetriever, SystemMessage, HumanMessage, AIMessage, BaseMessage
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.globals import set_llm_cache
+from langchain_community.cache import SQLiteCache
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Records are queued by the calling thread and written to stderr by a listener thread, so request paths never block on I/O.
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+_log_listener = QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+_queue_handler = QueueHandler(_log_queue)
+# Only the message is merged on the calling thread; timestamps and levels are formatted by the listener.
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
 logger = logging.getLogger('investment_analyzer')
 
+# Parent chunk sizes are measured in tokens of SPLIT_ENCODING; child chunk sizes in characters.
+SPLIT_ENCODING = "cl100k_base"
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 500))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 50))
+CHILD_CHUNK_SIZE = int(os.getenv("CHILD_CHUNK_SIZE", 256))
+CHILD_CHUNK_OVERLAP = int(os.getenv("CHILD_CHUNK_OVERLAP", 32))
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", 4))
+# MMR picks k diverse children out of the fetch_k nearest; lambda 0.5 weighs relevance and novelty equally.
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", 32))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", 0.5))
+# With reranking enabled, MMR returns this many candidates and the cross-encoder keeps the best RETRIEVAL_K.
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = 12
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+MODEL_NAME = os.getenv("MODEL_NAME", "gpt-4o-mini")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", 512))
+# Cached embeddings and vector stores are only reusable for the same model and dimensionality.
+EMBEDDING_NAMESPACE = f"{EMBEDDING_MODEL}-{EMBEDDING_DIMENSIONS}"
+# Used with embedding_backend="local"; requires the optional sentence-transformers package.
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5")
+LOCAL_EMBEDDING_NAMESPACE = LOCAL_EMBEDDING_MODEL.replace("/", "_")
+LOCAL_EMBEDDING_BATCH_SIZE = 64
+# Unset lets sentence-transformers pick CUDA (or Apple MPS) when available and fall back to the CPU.
+LOCAL_EMBEDDING_DEVICE = os.getenv("LOCAL_EMBEDDING_DEVICE")
+EMBEDDING_BATCH_SIZE = 512
+# Each embedding request carries at most this many input tokens, staying under the API's per-request cap.
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", 8000))
+EMBEDDING_MAX_CONCURRENCY = 8
+# Streamed child chunks are embedded once this many are pending, enough to keep every concurrent request full.
+STREAM_EMBED_BATCH = EMBEDDING_BATCH_SIZE * EMBEDDING_MAX_CONCURRENCY
+VECTORSTORE_CACHE_DIR = ".vectorstore_cache"
+MAX_CACHED_VECTORSTORES = 10
+EMBEDDING_CACHE_DIR = ".embedding_cache/"
+EMBEDDING_CACHE_DB = os.path.join(EMBEDDING_CACHE_DIR, "embeddings.sqlite3")
+EMBEDDING_CACHE_TTL_DAYS = int(os.getenv("EMBEDDING_CACHE_TTL_DAYS", 30))
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+PARENT_DOCS_FILE = "parents.json"
+FAISS_INDEX_FILE = "index.faiss"
+FILE_HASH_BLOCK_SIZE = 1 << 20
+DOC_ID_KEY = "doc_id"
+PARALLEL_PDF_MIN_PAGES = 16
+PARALLEL_SPLIT_MIN_DOCS = 8
+SPLIT_CHUNKSIZE = 8
+PERFORMANCE_LOG_SIZE = 200
+OPENAI_MAX_RETRIES = 3
+OPENAI_TIMEOUT = 30
+QUERY_MAX_CONCURRENCY = 10
+# One keep-alive pool per API key, shared by every embeddings and chat model instance.
+OPENAI_HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+SEMANTIC_CACHE_THRESHOLD = 0.97
+SEMANTIC_CACHE_SIZE = 256
+# Exact-match cache of LLM responses, enabled together with the semantic answer cache.
+LLM_CACHE_DB = ".llm_cache.sqlite3"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 2000))
+# Older turns are folded into a rolling summary, refreshed in the background every few turns.
+HISTORY_WINDOW = 4
+HISTORY_SUMMARY_MIN_TURNS = 8
+HISTORY_SUMMARY_EVERY = 4
+HISTORY_SUMMARY_CACHE_SIZE = 64
+HISTORY_SUMMARY_PROMPT = (
+    "Summarize the conversation below between a user and a financial analyst assistant in one short paragraph. "
+    "Keep figures, periods and company names exactly as stated."
+)
+CHUNK_ID_KEY = "chunk_id"
+N_TOKENS_KEY = "n_tokens"
+# Kept byte-identical across requests so OpenAI's prompt cache can reuse the prefix.
+QA_SYSTEM_PROMPT = (
+    "You are a financial analyst assistant answering questions about an investment report. "
+    "Use only the report excerpts in the CHUNK tags below. "
+    "If they do not contain the answer, say that you don't know instead of guessing."
+)
+# Flat and HNSW tiers store 8-bit scalar-quantized vectors (1 byte/dim instead of 4); ranking is ~unchanged.
+SCALAR_QUANTIZER = faiss.ScalarQuantizer.QT_8bit
+# Above this many vectors the flat scan gives way to an HNSW graph (logarithmic search).
+HNSW_MIN_VECTORS = 10_000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+# Past this the raw vectors stop fitting comfortably in RAM: IVF-PQ (nlist ~ 4*sqrt(N), 32 x 8-bit codes).
+IVFPQ_MIN_VECTORS = 100_000
+IVFPQ_M = 32
+IVFPQ_NPROBE = 16
+# Stored vectors are L2-normalized, so inner product ranks by cosine similarity (query norm does not affect order).
+FAISS_KWARGS = {"distance_strategy": DistanceStrategy.MAX_INNER_PRODUCT}
+
+# Loaded once per process: tiktoken caches the encoding, so later embedding calls skip the vocab load.
+_ENC = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+_CLIENT_CACHE: Dict[str, OpenAI] = {}
+_ASYNC_CLIENT_CACHE: Dict[str, AsyncOpenAI] = {}
+
+def _client(api_key: str) -> OpenAI:
+    if api_key not in _CLIENT_CACHE:
+        _CLIENT_CACHE[api_key] = OpenAI(api_key=api_key, max_retries=OPENAI_MAX_RETRIES, timeout=OPENAI_TIMEOUT,
+                                        http_client=DefaultHttpxClient(limits=OPENAI_HTTP_LIMITS))
+    return _CLIENT_CACHE[api_key]
+
+def _async_client(api_key: str) -> AsyncOpenAI:
+    # Only ever used on _LOOP (see _await_on_shared_loop), so its pooled connections stay on one event loop.
+    if api_key not in _ASYNC_CLIENT_CACHE:
+        _ASYNC_CLIENT_CACHE[api_key] = AsyncOpenAI(api_key=api_key, max_retries=OPENAI_MAX_RETRIES, timeout=OPENAI_TIMEOUT,
+                                                   http_client=DefaultAsyncHttpxClient(limits=OPENAI_HTTP_LIMITS))
+    return _ASYNC_CLIENT_CACHE[api_key]
+
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = threading.Lock()
+
+def _shared_loop() -> asyncio.AbstractEventLoop:
+    # One long-lived loop in a background thread, so async HTTP clients keep their connection pools between calls.
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_LOOP.run_forever, name="investment-analyzer-async", daemon=True).start()
+    return _LOOP
+
+def _run_async(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _shared_loop()).result()
+
+async def _await_on_shared_loop(coro):
+    # For public coroutines awaited from another loop: the pooled clients must never see a second loop.
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, _shared_loop()))
+
+_pdf_reader = None
+
+def _open_pdf(source: Union[str, bytes]) -> PdfReader:
+    return PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+def _init_pdf_worker(source: Union[str, bytes]) -> None:
+    global _pdf_reader
+    _pdf_reader = _open_pdf(source)
+
+def _extract_pdf_page(page_number: int) -> str:
+    return _pdf_reader.pages[page_number].extract_text()
+
+def _n_tokens(doc: Document) -> int:
+    # Counted once at split time; chunks from older caches fall back to encoding here.
+    n_tokens = doc.metadata.get(N_TOKENS_KEY)
+    return n_tokens if n_tokens is not None else len(_ENC.encode(doc.page_content))
+
+def _make_splitter(size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> TokenTextSplitter:
+    return TokenTextSplitter(encoding_name=SPLIT_ENCODING, chunk_size=size, chunk_overlap=overlap)
+
+_splitter = None
+
+def _init_split_worker(size: int, overlap: int) -> None:
+    global _splitter
+    _splitter = _make_splitter(size, overlap)
+
+def _split_one(doc: Document) -> List[Document]:
+    return _splitter.split_documents([doc])
+
+def _gpu_available() -> bool:
+    # faiss-cpu builds have no GPU symbols at all.
+    return hasattr(faiss, "StandardGpuResources") and faiss.get_num_gpus() > 0
+
+def _build_index(matrix: np.ndarray) -> faiss.Index:
+    n_vectors, dimensions = matrix.shape
+    if n_vectors <= HNSW_MIN_VECTORS:
+        index = faiss.IndexScalarQuantizer(dimensions, SCALAR_QUANTIZER, faiss.METRIC_INNER_PRODUCT)
+    elif n_vectors <= IVFPQ_MIN_VECTORS:
+        index = faiss.IndexHNSWSQ(dimensions, SCALAR_QUANTIZER, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    else:
+        nlist = int(4 * np.sqrt(n_vectors))
+        quantizer = faiss.IndexFlatIP(dimensions)
+        index = faiss.IndexIVFPQ(quantizer, dimensions, nlist, IVFPQ_M, 8, faiss.METRIC_INNER_PRODUCT)
+    # Each tier learns its codebook (SQ value ranges, IVF centroids and PQ codes) from the vectors it will hold.
+    if isinstance(index, faiss.IndexIVF) and _gpu_available():
+        # k-means training and PQ encoding run on the GPU with a faiss-gpu build. The filled index is
+        # copied back so it can be saved with write_index and searched (with reconstruct) as usual.
+        options = faiss.GpuClonerOptions()
+        options.useFloat16 = True
+        gpu_index = faiss.index_cpu_to_gpu(faiss.StandardGpuResources(), 0, index, options)
+        gpu_index.train(matrix)
+        gpu_index.add(matrix)
+        index = faiss.index_gpu_to_cpu(gpu_index)
+    else:
+        index.train(matrix)
+        index.add(matrix)
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = IVFPQ_NPROBE
+        # MMR re-reads candidate vectors with reconstruct(), which IVF indexes only support with a direct map.
+        index.make_direct_map()
+    return index
+
+if njit is not None:
+    # Serial on purpose: it is called from several threads at once, which a parallel kernel cannot
+    # survive under numba's workqueue threading layer, and it only scans a few hundred rows.
+    @njit(fastmath=True, cache=True)
+    def _cosine_kernel(matrix, query, out):
+        query_norm = 0.0
+        for j in range(query.shape[0]):
+            query_norm += query[j] * query[j]
+        for i in range(matrix.shape[0]):
+            dot = 0.0
+            row_norm = 0.0
+            for j in range(matrix.shape[1]):
+                dot += matrix[i, j] * query[j]
+                row_norm += matrix[i, j] * matrix[i, j]
+            out[i] = dot / np.sqrt(row_norm * query_norm)
+
+def _cosine_similarity(query: np.ndarray, matrix: np.ndarray) -> np.ndarray:
+    # A compiled kernel (Numba) or SimSIMD's AVX-512/NEON kernels when installed; numpy is the fallback.
+    if njit is not None:
+        # Dot product and row norms in one pass, with no intermediate arrays.
+        scores = np.empty(matrix.shape[0], dtype=np.float32)
+        _cosine_kernel(matrix, query.astype(matrix.dtype, copy=False), scores)
+        return scores
+    if simsimd is not None:
+        return 1.0 - np.asarray(simsimd.cdist(query[None], matrix, metric="cosine")).ravel()
+    return matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query))
+
+_WHITESPACE = re.compile(r"\s+")
+
+def _content_key(text: str) -> bytes:
+    # Chunks differing only in whitespace (reflowed headers, disclaimers) share a key.
+    return hashlib.blake2b(_WHITESPACE.sub(" ", text).strip().encode("utf-8"), digest_size=16).digest()
+
+def _token_batches(texts: List[str], max_tokens: int = EMBEDDING_BATCH_TOKENS,
+                   max_items: int = EMBEDDING_BATCH_SIZE) -> List[List[str]]:
+    batches, batch, batch_tokens = [], [], 0
+    for text, tokens in zip(texts, _ENC.encode_batch(texts)):
+        if batch and (batch_tokens + len(tokens) > max_tokens or len(batch) == max_items):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += len(tokens)
+    if batch:
+        batches.append(batch)
+    return batches
+
+async def _aembed_all(embeddings: OpenAIEmbeddings, texts: List[str]) -> List[List[float]]:
+    semaphore = asyncio.Semaphore(EMBEDDING_MAX_CONCURRENCY)
+
+    # Rate limits, timeouts and connection errors are retried by the shared client (OPENAI_MAX_RETRIES);
+    # authentication and request errors surface immediately.
+    async def embed_batch(batch: List[str]) -> List[List[float]]:
+        async with semaphore:
+            return await embeddings.aembed_documents(batch)
+
+    results = await asyncio.gather(*[embed_batch(batch) for batch in _token_batches(texts)])
+    return [vector for batch_vectors in results for vector in batch_vectors]
+
+def file_sha256(source: Union[str, BinaryIO]) -> str:
+    digest = hashlib.sha256()
+    stream = open(source, 'rb') if isinstance(source, str) else source
+    try:
+        for block in iter(lambda: stream.read(FILE_HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    finally:
+        if isinstance(source, str):
+            stream.close()
+        else:
+            source.seek(0)
+    return digest.hexdigest()
+
+def vectorstore_cache_dir(file_hash: str, embedding_namespace: str, cache_dir: str = VECTORSTORE_CACHE_DIR) -> str:
+    # Everything that changes the stored chunks or vectors is part of the key.
+    key = f"{file_hash[:16]}-{embedding_namespace}-{CHUNK_SIZE}x{CHUNK_OVERLAP}-{CHILD_CHUNK_SIZE}x{CHILD_CHUNK_OVERLAP}"
+    return os.path.join(cache_dir, key)
+
+def prune_vectorstore_cache(cache_dir: str = VECTORSTORE_CACHE_DIR, max_entries: int = MAX_CACHED_VECTORSTORES) -> None:
+    if not os.path.isdir(cache_dir):
+        return
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)]
+    entries = sorted((p for p in entries if os.path.isdir(p)), key=os.path.getmtime, reverse=True)
+    for stale in entries[max_entries:]:
+        shutil.rmtree(stale, ignore_errors=True)
+        logger.info("Evicted cached vector store %s.", stale)
+
+def _open_embedding_cache(db_path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    # WAL lets several processors (one per Streamlit session) read while another writes.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, created_at REAL NOT NULL)")
+    return conn
+
+def sweep_embedding_cache(db_path: str = EMBEDDING_CACHE_DB, max_age_days: int = EMBEDDING_CACHE_TTL_DAYS) -> None:
+    if not os.path.exists(db_path):
+        return
+    cutoff = time.time() - max_age_days * 86400
+    with closing(_open_embedding_cache(db_path)) as conn, conn:
+        removed = conn.execute("DELETE FROM embeddings WHERE created_at < ?", (cutoff,)).rowcount
+    if removed:
+        logger.info("Removed %d cached embeddings older than %d days.", removed, max_age_days)
+
+def trim_llm_cache(db_path: str = LLM_CACHE_DB, max_entries: int = LLM_CACHE_MAX_ENTRIES) -> None:
+    if not os.path.exists(db_path):
+        return
+    # LangChain's table has no timestamp; rowids grow with inserts, so the lowest are the oldest responses.
+    with closing(sqlite3.connect(db_path)) as conn, conn:
+        try:
+            removed = conn.execute(
+                "DELETE FROM full_llm_cache WHERE rowid NOT IN (SELECT rowid FROM full_llm_cache ORDER BY rowid DESC LIMIT ?)",
+                (max_entries,)).rowcount
+        except sqlite3.OperationalError:
+            # The table is created lazily by SQLiteCache.
+            return
+    if removed:
+        logger.info("Removed %d cached LLM responses beyond the newest %d.", removed, max_entries)
+
+class FastSplitter:
+    """Character splitter that looks for break points only near the end of each window.
+
+    Each chunk ends at the strongest break (paragraph, line, sentence, clause, word) in the back
+    half of its window, found with bounded str.rfind calls rather than by splitting the whole
+    text once per separator; the next chunk starts at a word boundary about chunk_overlap
+    characters earlier.
+    """
+
+    SEPARATORS = ("\n\n", "\n", ". ", ", ", " ")
+
+    def __init__(self, chunk_size: int, chunk_overlap: int):
+        if not 0 <= chunk_overlap < chunk_size // 2:
+            raise ValueError(f"chunk_overlap must be at least 0 and less than half of chunk_size, got {chunk_overlap} for chunk_size {chunk_size}.")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def _break_before(self, text: str, lo: int, hi: int) -> int:
+        for separator in self.SEPARATORS:
+            pos = text.rfind(separator, lo, hi)
+            if pos != -1:
+                return pos + len(separator)
+        return hi
+
+    def split_text(self, text: str) -> List[str]:
+        chunks, start, n = [], 0, len(text)
+        while start < n:
+            end = n if start + self.chunk_size >= n else \
+                self._break_before(text, start + self.chunk_size // 2, start + self.chunk_size)
+            chunk = text[start:end].strip()
+            if chunk:
+                chunks.append(chunk)
+            if end >= n:
+                break
+            # Overlap from the first word that begins at most chunk_overlap characters before the break.
+            space = text.find(" ", end - self.chunk_overlap, end)
+            start = max(start + 1, space + 1) if space != -1 else end
+        return chunks
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        return [Document(page_content=chunk, metadata=dict(doc.metadata))
+                for doc in documents for chunk in self.split_text(doc.page_content)]
+
+
+class CachedEmbeddings(Embeddings):
+    """Persists document embeddings in SQLite, keyed by SHA-256 of the model name and chunk text.
+
+    Query vectors are kept only in memory, in an LRU of the last QUERY_EMBEDDING_CACHE_SIZE (1024) questions,
+    so repeated questions skip the API call without query text being written to disk.
+    """
+
+    # Stay under SQLite's limit on bound parameters per statement.
+    LOOKUP_BATCH = 500
+
+    def __init__(self, underlying_embeddings: Embeddings, model_name: str, db_path: str = EMBEDDING_CACHE_DB):
+        self.underlying_embeddings = underlying_embeddings
+        self.model_name = model_name
+        self._conn = _open_embedding_cache(db_path)
+        self._lock = threading.Lock()
+        # Repeated questions (reruns, the semantic cache lookup followed by retrieval) skip the API round trip.
+        self._query_cache: "OrderedDict[str, Tuple[float, ...]]" = OrderedDict()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def mget(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        keys = [self._key(text) for text in texts]
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), self.LOOKUP_BATCH):
+                batch = keys[i:i + self.LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+                found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+        return [found.get(key) for key in keys]
+
+    def mset(self, texts: List[str], vectors: List[List[float]]) -> None:
+        now = time.time()
+        rows = [(self._key(text), np.asarray(vector, dtype=np.float32).tobytes(), now) for text, vector in zip(texts, vectors)]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, created_at) VALUES (?, ?, ?)", rows)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.mget(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            new_vectors = self.underlying_embeddings.embed_documents([texts[i] for i in missing])
+            self.mset([texts[i] for i in missing], new_vectors)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+        return [np.asarray(vector, dtype=np.float32).tolist() for vector in vectors]
+
+    def _cached_query(self, text: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._query_cache.get(text)
+            if vector is None:
+                return None
+            self._query_cache.move_to_end(text)
+        return list(vector)
+
+    def _cache_query(self, text: str, vector: List[float]) -> None:
+        with self._lock:
+            self._query_cache[text] = tuple(vector)
+            self._query_cache.move_to_end(text)
+            while len(self._query_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self._cached_query(text)
+        if vector is None:
+            vector = self.underlying_embeddings.embed_query(text)
+            self._cache_query(text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self._cached_query(text)
+        if vector is None:
+            vector = await self.underlying_embeddings.aembed_query(text)
+            self._cache_query(text, vector)
+        return vector
+
+class SemanticAnswerCache:
+    """LRU cache of answers keyed by question, matched by cosine similarity of question embeddings.
+
+    Entries hold only the answer and its sources, and callers add only standalone questions: one
+    processor, and so one cache, serves every conversation about a report.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD, max_entries: int = SEMANTIC_CACHE_SIZE):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[np.ndarray, Dict[str, Any]]]" = OrderedDict()
+        # Stacked vectors and their keys, rebuilt only after an insert or eviction.
+        self._matrix: Optional[np.ndarray] = None
+        self._keys: List[str] = []
+        # The processor, and with it this cache, is shared across Streamlit sessions.
+        self._lock = threading.Lock()
+
+    def lookup(self, query_vector: np.ndarray) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if not self._entries:
+                return None
+            if self._matrix is None:
+                self._keys = list(self._entries)
+                self._matrix = np.stack([self._entries[key][0] for key in self._keys])
+            matrix, keys = self._matrix, self._keys
+        scores = _cosine_similarity(query_vector / np.linalg.norm(query_vector), matrix)
+        best = int(scores.argmax())
+        if scores[best] < self.threshold:
+            return None
+        with self._lock:
+            entry = self._entries.get(keys[best])
+            if entry is None:
+                # Evicted by another thread while scoring.
+                return None
+            self._entries.move_to_end(keys[best])
+            return entry[1]
+
+    def add(self, query: str, query_vector: np.ndarray, result: Dict[str, Any]) -> None:
+        normalized = query_vector / np.linalg.norm(query_vector)
+        # The asker's question and conversation are not part of the shared answer.
+        answer = {key: value for key, value in result.items() if key not in ("question", "chat_history")}
+        with self._lock:
+            self._entries[query] = (normalized, answer)
+            self._entries.move_to_end(query)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+def _maximal_marginal_relevance(query: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    relevance = _cosine_similarity(query, candidates)
+    selected = [int(relevance.argmax())]
+    redundancy = _cosine_similarity(candidates[selected[0]], candidates)
+    while len(selected) < min(k, len(candidates)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        selected.append(int(scores.argmax()))
+        redundancy = np.maximum(redundancy, _cosine_similarity(candidates[selected[-1]], candidates))
+    return selected
+
+
+class MMRFAISS(FAISS):
+    """FAISS store whose MMR re-ranking scores candidates with _cosine_similarity.
+
+    LangChain's own MMR helper breaks when simsimd 4 or later is installed, so selection is done here.
+    """
+
+    def max_marginal_relevance_search_with_score_by_vector(self, embedding: List[float], *, k: int = 4, fetch_k: int = 20,
+                                                           lambda_mult: float = 0.5, filter: Optional[Any] = None,
+                                                           **kwargs: Any) -> List[Tuple[Document, float]]:
+        if filter is not None:
+            raise ValueError("Metadata filters are not supported with MMR search.")
+        scores, indices = self.index.search(np.asarray([embedding], dtype=np.float32), fetch_k)
+        # -1 marks empty slots when the index holds fewer than fetch_k vectors.
+        positions = [pos for pos, i in enumerate(indices[0]) if i != -1]
+        if not positions:
+            return []
+        candidates = np.vstack([self.index.reconstruct(int(indices[0][pos])) for pos in positions])
+        selected = _maximal_marginal_relevance(np.asarray(embedding, dtype=np.float32), candidates, k, lambda_mult)
+        return [(self.docstore.search(self.index_to_docstore_id[int(indices[0][positions[i]])]), float(scores[0][positions[i]]))
+                for i in selected]
+
+
+class PrefixCachedQAChain:
+    """Retrieval QA chain whose prompt layout is stable across queries.
+
+    The system prompt comes first, then the retrieved chunks ordered by chunk id, then the
+    conversation summary, recent turns and the question, so requests touching the same chunks
+    share a cacheable prefix.
+    """
+
+    def __init__(self, llm: ChatOpenAI, retriever: BaseRetriever):
+        self.llm = llm
+        self.retriever = retriever
+
+    def _build_messages(self, question: str, chat_history: List[Tuple[str, str]], docs: List[Document],
+                        history_summary: str = "") -> List[BaseMessage]:
+        chunks = "\n".join(f'<CHUNK i="{doc.metadata.get(CHUNK_ID_KEY, 0)}">\n{doc.page_content}\n</CHUNK>' for doc in docs)
+        messages: List[BaseMessage] = [SystemMessage(content=f"{QA_SYSTEM_PROMPT}\n\n{chunks}")]
+        if history_summary:
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation: {history_summary}"))
+        for human, ai in chat_history:
+            messages.extend([HumanMessage(content=human), AIMessage(content=ai)])
+        messages.append(HumanMessage(content=question))
+        return messages
+
+    @staticmethod
+    def _pack(docs: List[Document], budget: int = CONTEXT_TOKEN_BUDGET) -> List[Document]:
+        # Keep chunks in relevance order until the token budget is spent; the best match is always kept.
+        packed, used = [], 0
+        for doc in docs:
+            n_tokens = _n_tokens(doc)
+            if packed and used + n_tokens > budget:
+                break
+            packed.append(doc)
+            used += n_tokens
+        return packed
+
+    def __call__(self, inputs: Dict[str, Any], callbacks: Optional[List[BaseCallbackHandler]] = None) -> Dict[str, Any]:
+        question = inputs["question"]
+        chat_history = inputs.get("chat_history", [])
+        config = {"callbacks": callbacks}
+        docs = self._pack(self.retriever.invoke(question, config=config))
+        docs = sorted(docs, key=lambda doc: doc.metadata.get(CHUNK_ID_KEY, 0))
+        messages = self._build_messages(question, chat_history, docs, inputs.get("history_summary", ""))
+        answer = self.llm.invoke(messages, config=config).content
+        return {"question": question, "chat_history": chat_history, "answer": answer, "source_documents": docs}
+
+    async def ainvoke(self, inputs: Dict[str, Any], callbacks: Optional[List[BaseCallbackHandler]] = None) -> Dict[str, Any]:
+        question = inputs["question"]
+        chat_history = inputs.get("chat_history", [])
+        config = {"callbacks": callbacks}
+        docs = self._pack(await self.retriever.ainvoke(question, config=config))
+        docs = sorted(docs, key=lambda doc: doc.metadata.get(CHUNK_ID_KEY, 0))
+        messages = self._build_messages(question, chat_history, docs, inputs.get("history_summary", ""))
+        answer = (await self.llm.ainvoke(messages, config=config)).content
+        return {"question": question, "chat_history": chat_history, "answer": answer, "source_documents": docs}
+
+
 class DocumentProcessor:
     
-    def __init__(self, openai_api_key: str):
+    def __init__(self, openai_api_key: str, num_workers: Optional[int] = None, enable_semantic_cache: bool = False,
+                 embedding_backend: str = "openai", enable_reranker: bool = False):
         self.openai_api_key = openai_api_key
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.enable_semantic_cache = enable_semantic_cache
+        self.embedding_backend = embedding_backend
+        self.enable_reranker = enable_reranker
+        self._reranker = None
         os.environ["OPENAI_API_KEY"] = openai_api_key
-        self.performance_logs = []
+        # Running totals per operation keep the summary O(#operations); recent spans are kept for inspection.
+        self._op_counts: Counter = Counter()
+        self._op_totals_ns: DefaultDict[str, int] = defaultdict(int)
+        self.performance_logs: Deque[Dict[str, Any]] = deque(maxlen=PERFORMANCE_LOG_SIZE)
+        self._perf_lock = threading.Lock()
+        # Summaries keyed by the exact turns they cover, so conversations sharing this processor never mix.
+        self._history_summaries: "OrderedDict[Tuple[Tuple[str, str], ...], Future]" = OrderedDict()
+        self._summary_lock = threading.Lock()
+        self._summary_executor = ThreadPoolExecutor(max_workers=1)
+        # Blocking ingestion work (splitting, cache writes, local embedding) runs here, off the event loop.
+        self._ingest_executor = ThreadPoolExecutor(max_workers=2)
+        self._summary_llm = ChatOpenAI(temperature=0, model_name=MODEL_NAME, openai_api_key=openai_api_key,
+                                       client=_client(openai_api_key).chat.completions,
+                                       async_client=_async_client(openai_api_key).chat.completions)
+        self.text_splitter = _make_splitter()
+        self.child_splitter = FastSplitter(CHILD_CHUNK_SIZE, CHILD_CHUNK_OVERLAP)
+        self._answer_cache = SemanticAnswerCache()
+        if enable_semantic_cache:
+            set_llm_cache(SQLiteCache(database_path=LLM_CACHE_DB))
+        self.docstore = InMemoryStore()
+        if embedding_backend == "local":
+            self.embedding_namespace = LOCAL_EMBEDDING_NAMESPACE
+        elif embedding_backend == "openai":
+            self.embedding_namespace = EMBEDDING_NAMESPACE
+        else:
+            raise ValueError(f"Unsupported embedding backend: {embedding_backend}")
+        # Built on first use, then shared by every store and chain this processor creates.
+        self._embeddings: Optional[CachedEmbeddings] = None
+        self._llm: Optional[ChatOpenAI] = None
     
-    def load_document(self, file_path: str) -> Tuple[List[Document], Dict[str, Any]]:
-        start_time = time.time()
-        try:
-            if file_path.endswith('.pdf'):
-                loader = PyPDFLoader(file_path)
-                documents = loader.load()
-                file_type = 'pdf'
-            elif file_path.endswith('.docx'):
-                loader = Docx2txtLoader(file_path)
-                documents = loader.load()
-                file_type = 'docx'
+    @property
+    def embeddings(self) -> CachedEmbeddings:
+        if self._embeddings is None:
+            if self.embedding_backend == "local":
+                from langchain_community.embeddings import HuggingFaceEmbeddings
+                underlying = HuggingFaceEmbeddings(
+                    model_name=LOCAL_EMBEDDING_MODEL,
+                    model_kwargs={"device": LOCAL_EMBEDDING_DEVICE} if LOCAL_EMBEDDING_DEVICE else {},
+                    encode_kwargs={"batch_size": LOCAL_EMBEDDING_BATCH_SIZE, "normalize_embeddings": True}
+                )
             else:
-                raise ValueError(f"Unsupported file type: {file_path}")
+                underlying = OpenAIEmbeddings(
+                    model=EMBEDDING_MODEL,
+                    dimensions=EMBEDDING_DIMENSIONS,
+                    openai_api_key=self.openai_api_key,
+                    chunk_size=EMBEDDING_BATCH_SIZE,
+                    client=_client(self.openai_api_key).embeddings,
+                    async_client=_async_client(self.openai_api_key).embeddings
+                )
+            self._embeddings = CachedEmbeddings(underlying, self.embedding_namespace)
+        return self._embeddings
+    
+    @property
+    def llm(self) -> ChatOpenAI:
+        if self._llm is None:
+            # Retries and timeouts come from the shared clients; callbacks are passed per call.
+            self._llm = ChatOpenAI(temperature=0, model_name=MODEL_NAME, streaming=True, openai_api_key=self.openai_api_key,
+                                   client=_client(self.openai_api_key).chat.completions,
+                                   async_client=_async_client(self.openai_api_key).chat.completions)
+        return self._llm
+    
+    def load_document(self, source: Union[str, BinaryIO], file_name: Optional[str] = None) -> Tuple[List[Document], Dict[str, Any]]:
+        try:
+            with self._measure("document_loading") as span:
+                # Uploads can be passed as in-memory streams; file_name then supplies the extension.
+                name = file_name or source
+                if name.lower().endswith('.pdf'):
+                    documents = self._load_pdf(source, name)
+                    file_type = 'pdf'
+                elif name.lower().endswith('.docx'):
+                    documents = [Document(page_content=docx2txt.process(source), metadata={"source": name})]
+                    file_type = 'docx'
+                else:
+                    raise ValueError(f"Unsupported file type: {name}")
+                span.update(file_type=file_type, page_count=len(documents))
             
-            processing_time = time.time() - start_time
-            performance_data = {
-                "operation": "document_loading",
-                "file_type": file_type,
-                "page_count": len(documents),
-                "processing_time": processing_time
-            }
-            self.performance_logs.append(performance_data)
-            logger.info(f"Loaded {len(documents)} pages from {file_type} document in {processing_time:.2f}s.")
-            return documents, performance_data
+            logger.info("Loaded %d pages from %s document in %.2fs.", len(documents), file_type, span["processing_time"])
+            return documents, span
         except Exception as e:
-            logger.error(f"Error loading document: {e}")
+            logger.error("Error loading document: %s", e)
             raise
     
+    def iter_load(self, source: Union[str, BinaryIO], file_name: Optional[str] = None) -> Iterator[Document]:
+        name = file_name or source
+        if name.lower().endswith('.pdf'):
+            # pypdf parses pages on access, so only the current page's text is held in memory.
+            reader = _open_pdf(source)
+            for i, page in enumerate(reader.pages):
+                yield Document(page_content=page.extract_text(), metadata={"source": name, "page": i})
+        elif name.lower().endswith('.docx'):
+            yield Document(page_content=docx2txt.process(source), metadata={"source": name})
+        else:
+            raise ValueError(f"Unsupported file type: {name}")
+    
+    def iter_split(self, documents: Iterable[Document]) -> Iterator[Document]:
+        chunk_id = 0
+        for doc in documents:
+            splits = self.text_splitter.split_documents([doc])
+            for split, tokens in zip(splits, _ENC.encode_batch([split.page_content for split in splits])):
+                split.metadata[CHUNK_ID_KEY] = chunk_id
+                split.metadata[N_TOKENS_KEY] = len(tokens)
+                chunk_id += 1
+                yield split
+    
+    def stream_load_and_split(self, source: Union[str, BinaryIO], file_name: Optional[str] = None) -> Iterator[Document]:
+        try:
+            with self._measure("document_streaming") as span:
+                page_count = chunk_count = 0
+                
+                def counted_pages() -> Iterator[Document]:
+                    nonlocal page_count
+                    for page in self.iter_load(source, file_name):
+                        page_count += 1
+                        yield page
+                
+                for split in self.iter_split(counted_pages()):
+                    chunk_count += 1
+                    yield split
+                span.update(page_count=page_count, output_chunks=chunk_count)
+            
+            logger.info("Streamed %d pages into %d chunks in %.2fs.", page_count, chunk_count, span["processing_time"])
+        except Exception as e:
+            logger.error("Error streaming document: %s", e)
+            raise
+    
+    def _load_pdf(self, source: Union[str, BinaryIO], name: str) -> List[Document]:
+        # Workers receive a path or raw bytes, both of which pickle cheaply.
+        pdf_source = source if isinstance(source, str) else source.read()
+        reader = _open_pdf(pdf_source)
+        page_count = len(reader.pages)
+        if self.num_workers > 1 and page_count >= PARALLEL_PDF_MIN_PAGES:
+            # Each worker opens the PDF once and extracts the pages it is handed, in runs of pages
+            # (about four per worker) rather than one IPC round-trip per page.
+            chunksize = max(1, page_count // (self.num_workers * 4))
+            with ProcessPoolExecutor(max_workers=self.num_workers, initializer=_init_pdf_worker, initargs=(pdf_source,)) as executor:
+                texts = list(executor.map(_extract_pdf_page, range(page_count), chunksize=chunksize))
+        else:
+            texts = [page.extract_text() for page in reader.pages]
+        return [Document(page_content=text, metadata={"source": name, "page": i}) for i, text in enumerate(texts)]
+    
     def split_documents(self, documents: List[Document]) -> Tuple[List[Document], Dict[str, Any]]:
-        start_time = time.time()
         try:
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=1500, chunk_overlap=150)
-            splits = text_splitter.split_documents(documents)
+            with self._measure("document_splitting", input_docs=len(documents)) as span:
+                # Pages split independently; small documents don't repay the pool start-up cost.
+                if len(documents) >= PARALLEL_SPLIT_MIN_DOCS and self.num_workers > 1:
+                    # Each worker builds its splitter once; pages travel in batches of SPLIT_CHUNKSIZE.
+                    with ProcessPoolExecutor(max_workers=self.num_workers, initializer=_init_split_worker,
+                                             initargs=(CHUNK_SIZE, CHUNK_OVERLAP)) as executor:
+                        splits = list(chain.from_iterable(executor.map(_split_one, documents, chunksize=SPLIT_CHUNKSIZE)))
+                else:
+                    splits = self.text_splitter.split_documents(documents)
+                # encode_batch tokenizes across threads in tiktoken's native backend.
+                token_counts = _ENC.encode_batch([split.page_content for split in splits])
+                for i, (split, tokens) in enumerate(zip(splits, token_counts)):
+                    split.metadata[CHUNK_ID_KEY] = i
+                    split.metadata[N_TOKENS_KEY] = len(tokens)
+                span["output_chunks"] = len(splits)
             
-            processing_time = time.time() - start_time
-            performance_data = {
-                "operation": "document_splitting",
-                "input_docs": len(documents),
-                "output_chunks": len(splits),
-                "processing_time": processing_time
-            }
-            self.performance_logs.append(performance_data)
-            logger.info(f"Split {len(documents)} documents into {len(splits)} chunks in {processing_time:.2f}s.")
-            return splits, performance_data
+            logger.info("Split %d documents into %d chunks in %.2fs.", len(documents), len(splits), span["processing_time"])
+            return splits, span
         except Exception as e:
-            logger.error(f"Error splitting documents: {e}")
+            logger.error("Error splitting documents: %s", e)
             raise
     
-    def create_vectorstore(self, splits: List[Document]) -> Tuple[Chroma, Dict[str, Any]]:
-        start_time = time.time()
+    async def _aembed_texts(self, texts: List[str]) -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        vectors = await loop.run_in_executor(self._ingest_executor, self.embeddings.mget, texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            # Repeated boilerplate is embedded once; every copy keeps its own entry and metadata in the store.
+            slot_by_key: Dict[bytes, int] = {}
+            unique_texts, slots = [], []
+            for text in missing_texts:
+                key = _content_key(text)
+                if key not in slot_by_key:
+                    slot_by_key[key] = len(unique_texts)
+                    unique_texts.append(text)
+                slots.append(slot_by_key[key])
+            underlying = self.embeddings.underlying_embeddings
+            if self.embedding_backend == "local":
+                # The local model batches internally; concurrent requests would only contend for the CPU.
+                unique_vectors = await loop.run_in_executor(self._ingest_executor, underlying.embed_documents, unique_texts)
+            else:
+                unique_vectors = await _aembed_all(underlying, unique_texts)
+            new_vectors = [unique_vectors[slot] for slot in slots]
+            await loop.run_in_executor(self._ingest_executor, self.embeddings.mset, missing_texts, new_vectors)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+            logger.info("Embedded %d unique texts for %d uncached chunks.", len(unique_texts), len(missing))
+        logger.info("Embedding cache served %d/%d chunks.", len(texts) - len(missing), len(texts))
+        return vectors
+    
+    async def _aembed_block(self, children: List[Document]) -> np.ndarray:
+        block = np.asarray(await self._aembed_texts([d.page_content for d in children]), dtype=np.float32)
+        faiss.normalize_L2(block)
+        return block
+    
+    def _next_children(self, parents_iter: Iterator[Document], parent_ids: List[str], parents: List[Document]) -> List[Document]:
+        # Pulls parents off the (possibly lazy) iterator until a full embedding batch of children is ready.
+        batch = []
+        for parent in parents_iter:
+            parent_id = uuid.uuid4().hex
+            parent_ids.append(parent_id)
+            parents.append(parent)
+            for child in self.child_splitter.split_documents([parent]):
+                child.metadata[DOC_ID_KEY] = parent_id
+                batch.append(child)
+            if len(batch) >= STREAM_EMBED_BATCH:
+                break
+        return batch
+    
+    def create_vectorstore(self, splits: Iterable[Document], persist_directory: Optional[str] = None) -> Tuple[MMRFAISS, Dict[str, Any]]:
+        return _run_async(self.acreate_vectorstore(splits, persist_directory))
+    
+    async def acreate_vectorstore(self, splits: Iterable[Document], persist_directory: Optional[str] = None) -> Tuple[MMRFAISS, Dict[str, Any]]:
+        if asyncio.get_running_loop() is not _shared_loop():
+            return await _await_on_shared_loop(self.acreate_vectorstore(splits, persist_directory))
         try:
-            embeddings = OpenAIEmbeddings()
-            vectorstore = Chroma.from_documents(documents=splits, embedding=embeddings)
+            with self._measure("vectorstore_creation") as span:
+                # Small child chunks are embedded for retrieval; the LLM is given their parent chunk.
+                # splits may be a generator: children are embedded in batches as parents arrive, and each
+                # batch is kept as a float32 block rather than as lists of Python floats.
+                loop = asyncio.get_running_loop()
+                parents_iter = iter(splits)
+                parent_ids, parents, children, blocks = [], [], [], []
+                in_flight = None
+                try:
+                    while True:
+                        # The next batch is read and split on the ingest thread while the previous one is embedded.
+                        batch = await loop.run_in_executor(self._ingest_executor, self._next_children, parents_iter, parent_ids, parents)
+                        if in_flight is not None:
+                            blocks.append(await in_flight)
+                            in_flight = None
+                        if not batch:
+                            break
+                        children.extend(batch)
+                        in_flight = asyncio.ensure_future(self._aembed_block(batch))
+                finally:
+                    # A loading or splitting error must not leave a batch still calling the embeddings API.
+                    if in_flight is not None:
+                        in_flight.cancel()
+                        await asyncio.gather(in_flight, return_exceptions=True)
+                if not children:
+                    # Scanned PDFs without a text layer end up here.
+                    raise ValueError("No text could be extracted from the document.")
+                self.docstore = InMemoryStore()
+                self.docstore.mset(list(zip(parent_ids, parents)))
+
+                index = _build_index(np.vstack(blocks))
+                ids = [uuid.uuid4().hex for _ in children]
+                docstore = InMemoryDocstore(dict(zip(ids, children)))
+                vectorstore = MMRFAISS(self.embeddings, index, docstore, dict(enumerate(ids)), **FAISS_KWARGS)
+                if persist_directory:
+                    vectorstore.save_local(persist_directory)
+                    records = [{"id": i, "page_content": d.page_content, "metadata": d.metadata} for i, d in zip(parent_ids, parents)]
+                    with open(os.path.join(persist_directory, PARENT_DOCS_FILE), 'w') as f:
+                        json.dump(records, f)
+                span.update(chunk_count=len(parents), child_chunk_count=len(children))
             
-            processing_time = time.time() - start_time
-            performance_data = {
-                "operation": "vectorstore_creation",
-                "chunk_count": len(splits),
-                "processing_time": processing_time
-            }
-            self.performance_logs.append(performance_data)
-            logger.info(f"Created vector store from {len(splits)} chunks in {processing_time:.2f}s.")
-            return vectorstore, performance_data
+            logger.info("Created vector store from %d child chunks of %d chunks in %.2fs.", len(children), len(parents), span["processing_time"])
+            return vectorstore, span
         except Exception as e:
-            logger.error(f"Error creating vector store: {e}")
+            logger.error("Error creating vector store: %s", e)
             raise
     
-    def create_qa_chain(self, vectorstore: Chroma) -> ConversationalRetrievalChain:
+    def load_vectorstore(self, persist_directory: str) -> Tuple[MMRFAISS, Dict[str, Any]]:
         try:
-            llm = ChatOpenAI(temperature=0, model_name="gpt-3.5-turbo-16k")
-            qa_chain = ConversationalRetrievalChain.from_llm(
-                llm,
-                vectorstore.as_retriever(search_kwargs={"k": 6}),
-                return_source_documents=True
+            with self._measure("vectorstore_loading") as span:
+                # The pickled docstore was written by create_vectorstore in this cache, not taken from an upload.
+                vectorstore = MMRFAISS.load_local(persist_directory, self.embeddings, allow_dangerous_deserialization=True, **FAISS_KWARGS)
+                with open(os.path.join(persist_directory, PARENT_DOCS_FILE)) as f:
+                    parents = json.load(f)
+                self.docstore = InMemoryStore()
+                self.docstore.mset([(p["id"], Document(page_content=p["page_content"], metadata=p["metadata"])) for p in parents])
+                # Touch the directory so LRU eviction sees it as recently used.
+                os.utime(persist_directory)
+                span["chunk_count"] = len(parents)
+
+            logger.info("Loaded cached vector store from %s in %.2fs.", persist_directory, span["processing_time"])
+            return vectorstore, span
+        except Exception as e:
+            logger.error("Error loading vector store: %s", e)
+            raise
+    
+    def load_or_create_vectorstore(self, source: Union[str, BinaryIO], file_name: Optional[str] = None,
+                                   file_hash: Optional[str] = None) -> Tuple[MMRFAISS, Dict[str, Any]]:
+        # A caller that already hashed the upload passes file_hash, so a cache hit never reads the file.
+        persist_dir = vectorstore_cache_dir(file_hash or file_sha256(source), self.embedding_namespace)
+        # A store counts as cached only once both files are written; an interrupted build is redone.
+        if all(os.path.isfile(os.path.join(persist_dir, name)) for name in (FAISS_INDEX_FILE, PARENT_DOCS_FILE)):
+            return self.load_vectorstore(persist_dir)
+        try:
+            docs, _ = self.load_document(source, file_name)
+            splits, _ = self.split_documents(docs)
+            vectorstore, build_info = self.create_vectorstore(splits, persist_directory=persist_dir)
+        except Exception:
+            shutil.rmtree(persist_dir, ignore_errors=True)
+            raise
+        prune_vectorstore_cache()
+        sweep_embedding_cache()
+        trim_llm_cache()
+        return vectorstore, build_info
+    
+    def create_qa_chain(self, vectorstore: MMRFAISS) -> PrefixCachedQAChain:
+        try:
+            retriever = MultiVectorRetriever(
+                vectorstore=vectorstore,
+                docstore=self.docstore,
+                id_key=DOC_ID_KEY,
+                search_type=SearchType.mmr,
+                search_kwargs={
+                    "k": RERANK_CANDIDATES if self.enable_reranker else RETRIEVAL_K,
+                    "fetch_k": RETRIEVAL_FETCH_K,
+                    "lambda_mult": MMR_LAMBDA
+                }
             )
+            if self.enable_reranker:
+                retriever = ContextualCompressionRetriever(base_compressor=self._get_reranker(), base_retriever=retriever)
+            qa_chain = PrefixCachedQAChain(self.llm, retriever)
             logger.info("Created Q&A chain.")
             return qa_chain
         except Exception as e:
-            logger.error(f"Error creating Q&A chain: {e}")
+            logger.error("Error creating Q&A chain: %s", e)
             raise
     
-    def process_query(self, qa_chain: ConversationalRetrievalChain, query: str, chat_history: List[Tuple[str, str]]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
-        start_time = time.time()
+    def _get_reranker(self):
+        # Loaded on first use and shared by every chain this processor creates.
+        if self._reranker is None:
+            from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+            from langchain.retrievers.document_compressors import CrossEncoderReranker
+            self._reranker = CrossEncoderReranker(model=HuggingFaceCrossEncoder(model_name=RERANK_MODEL), top_n=RETRIEVAL_K)
+        return self._reranker
+    
+    def _summarize_history(self, previous_summary: str, turns: List[Tuple[str, str]]) -> str:
+        transcript = "\n".join(f"User: {human}\nAssistant: {ai}" for human, ai in turns)
+        if previous_summary:
+            transcript = f"Earlier summary: {previous_summary}\n\n{transcript}"
+        messages = [SystemMessage(content=HISTORY_SUMMARY_PROMPT), HumanMessage(content=transcript)]
+        return self._summary_llm.invoke(messages).content
+    
+    def _compact_history(self, chat_history: List[Tuple[str, str]]) -> Tuple[str, List[Tuple[str, str]]]:
+        history = [tuple(turn) for turn in chat_history]
+        history_key = tuple(history)
+        with self._summary_lock:
+            summary, covered, pending = "", 0, False
+            for key, future in self._history_summaries.items():
+                if len(key) > len(history) or history_key[:len(key)] != key:
+                    continue
+                if not future.done():
+                    pending = True
+                elif future.exception() is None and len(key) > covered:
+                    summary, covered = future.result(), len(key)
+            if covered:
+                # Only the newest finished summary of a conversation is needed; shorter ones are superseded.
+                superseded = [key for key, future in self._history_summaries.items()
+                              if len(key) < covered and future.done() and history_key[:len(key)] == key]
+                for key in superseded:
+                    del self._history_summaries[key]
+                self._history_summaries.move_to_end(history_key[:covered])
+            
+            # Turns not yet summarized stay verbatim, so nothing is dropped while a refresh is in flight.
+            boundary = len(history) - HISTORY_WINDOW
+            if not pending and len(history) > HISTORY_SUMMARY_MIN_TURNS and boundary - covered >= HISTORY_SUMMARY_EVERY:
+                key = history_key[:boundary]
+                if key not in self._history_summaries:
+                    self._history_summaries[key] = self._summary_executor.submit(
+                        self._summarize_history, summary, history[covered:boundary])
+                    while len(self._history_summaries) > HISTORY_SUMMARY_CACHE_SIZE:
+                        self._history_summaries.popitem(last=False)
+        return summary, history[covered:]
+    
+    def _chain_inputs(self, query: str, chat_history: List[Tuple[str, str]]) -> Dict[str, Any]:
+        history_summary, recent_history = self._compact_history(chat_history)
+        return {"question": query, "chat_history": recent_history, "history_summary": history_summary}
+    
+    def process_query(self, qa_chain: PrefixCachedQAChain, query: str, chat_history: List[Tuple[str, str]],
+                      callbacks: Optional[List[BaseCallbackHandler]] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
         try:
-            result = qa_chain({"question": query, "chat_history": chat_history})
+            with self._measure("query_processing", query_length=len(query)) as span:
+                result = None
+                # Follow-ups are answered in the context of their conversation, so only standalone
+                # questions read or fill the cache shared by every session on this processor.
+                use_cache = self.enable_semantic_cache and not chat_history
+                if use_cache:
+                    # Near-duplicate questions reuse an earlier answer instead of running the chain again.
+                    query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+                    result = self._answer_cache.lookup(query_vector)
+                cache_hit = result is not None
+                
+                if cache_hit:
+                    result = {**result, "question": query, "chat_history": chat_history}
+                else:
+                    result = qa_chain(self._chain_inputs(query, chat_history), callbacks=callbacks)
+                    if use_cache:
+                        self._answer_cache.add(query, query_vector, result)
+                span.update(response_length=len(result["answer"]), cache_hit=cache_hit)
             
-            processing_time = time.time() - start_time
-            performance_data = {
-                "operation": "query_processing",
-                "query_length": len(query),
-                "response_length": len(result["answer"]),
-                "processing_time": processing_time
-            }
-            self.performance_logs.append(performance_data)
-            logger.info(f"Processed query in {processing_time:.2f}s.")
-            return result, performance_data
+            logger.info("Processed query in %.2fs%s.", span["processing_time"], " (semantic cache hit)" if cache_hit else "")
+            return result, span
         except Exception as e:
-            logger.error(f"Error processing query: {e}")
+            logger.error("Error processing query: %s", e)
             raise
-
-    def get_performance_summary(self) -> Dict[str, Any]:
-        if not self.performance_logs:
-            return {}
-        
-        summary = {
-            "total_operations": len(self.performance_logs),
-            "total_processing_time": sum(log["processing_time"] for log in self.performance_logs),
-            "operation_counts": {},
-            "average_times": {}
-        }
-        
-        operation_groups = {}
-        for log in self.performance_logs:
-            op = log["operation"]
-            if op not in operation_groups:
-                operation_groups[op] = []
-            operation_groups[op].append(log)
-        
-        for op, logs in operation_groups.items():
-            summary["operation_counts"][op] = len(logs)
-            summary["average_times"][op] = sum(log["processing_time"] for log in logs) / len(logs)
+    
+    async def aprocess_query(self, qa_chain: PrefixCachedQAChain, query: str, chat_history: List[Tuple[str, str]],
+                             callbacks: Optional[List[BaseCallbackHandler]] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        if asyncio.get_running_loop() is not _shared_loop():
+            return await _await_on_shared_loop(self.aprocess_query(qa_chain, query, chat_history, callbacks))
+        try:
+            with self._measure("query_processing", query_length=len(query)) as span:
+                result = None
+                use_cache = self.enable_semantic_cache and not chat_history
+                if use_cache:
+                    query_vector = np.asarray(await self.embeddings.aembed_query(query), dtype=np.float32)
+                    result = self._answer_cache.lookup(query_vector)
+                cache_hit = result is not None
+                
+                if cache_hit:
+                    result = {**result, "question": query, "chat_history": chat_history}
+                else:
+                    result = await qa_chain.ainvoke(self._chain_inputs(query, chat_history), callbacks=callbacks)
+                    if use_cache:
+                        self._answer_cache.add(query, query_vector, result)
+                span.update(response_length=len(result["answer"]), cache_hit=cache_hit)
+            
+            logger.info("Processed query in %.2fs%s.", span["processing_time"], " (semantic cache hit)" if cache_hit else "")
+            return result, span
+        except Exception as e:
+            logger.error("Error processing query: %s", e)
+            raise
+    
+    def process_queries(self, qa_chain: PrefixCachedQAChain, queries: List[str],
+                        max_concurrency: int = QUERY_MAX_CONCURRENCY) -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        # Independent questions answered concurrently, each without chat history.
+        async def run_all() -> List[Tuple[Dict[str, Any], Dict[str, Any]]]:
+            semaphore = asyncio.Semaphore(max_concurrency)
+            
+            async def run(query: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+                async with semaphore:
+                    return await self.aprocess_query(qa_chain, query, [])
+            
+            return await asyncio.gather(*[run(query) for query in queries])
         
-        return summary
\ No newline at end of file
+        return _run_async(run_all())
+    
+    @contextmanager
+    def _measure(self, operation: str, **details: Any) -> Iterator[Dict[str, Any]]:
+        # Callers add result details to the yielded span; it is recorded only if the block completes.
+        span = {"operation": operation, **details}
+        start_ns = time.perf_counter_ns()
+        yield span
+        elapsed_ns = time.perf_counter_ns() - start_ns
+        span["processing_time"] = elapsed_ns / 1e9
+        with self._perf_lock:
+            self._op_counts[operation] += 1
+            self._op_totals_ns[operation] += elapsed_ns
+            self.performance_logs.append(span)
+    
+    def get_performance_summary(self) -> Dict[str, Any]:
+        with self._perf_lock:
+            if not self._op_counts:
+                return {}
+            
+            return {
+                "total_operations": sum(self._op_counts.values()),
+                "total_processing_time": sum(self._op_totals_ns.values()) / 1e9,
+                "operation_counts": dict(self._op_counts),
+                "average_times": {op: self._op_totals_ns[op] / count / 1e9 for op, count in self._op_counts.items()}
+            }